@@ -1,39 +1,138 @@
-import os, io, re, logging
+import os, io, re, string, hashlib, logging, queue, threading, time, uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from decimal import Decimal
+from flask import Flask, Response, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from psycopg2.pool import SimpleConnectionPool
-from PyPDF2 import PdfReader
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
+from flask_compress import Compress
+from werkzeug.exceptions import RequestEntityTooLarge
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+import fitz  # PyMuPDF
+import httpx
+import orjson
 from openai import OpenAI
 from io import BytesIO
-from docx import Document
-from docx.shared import Inches
-from docx.enum.section import WD_ORIENT
+from html import escape
+from docx_export import build_docx
 
 # ------------------------------------------------------------
 # APP SETUP
 # ------------------------------------------------------------
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (C encoder) instead of stdlib json."""
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, Decimal):  # NUMERIC columns
+            return float(obj)
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-logging.basicConfig(level=logging.INFO)
+app.json = ORJSONProvider(app)
+# Oversized uploads are refused with 413 before any parsing happens
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", 8)) * 1024 * 1024
+
+@app.before_request
+def read_request_body():
+    """Reads the body up front so an oversized upload fails here, not inside a route's try/except."""
+    # Parses (and spools) multipart forms or caches raw bodies; routes then read them from memory
+    if request.method == "POST":
+        request.get_data(parse_form_data=True)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Reports oversized request bodies in the same JSON shape as other errors."""
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    return jsonify({"status": "error", "message": f"Upload exceeds {limit_mb} MB."}), 413
+
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor-Ts", "X-Next-Cursor-Id"])
+# Compress JSON and lesson HTML; SSE is left alone so events aren't buffered
+app.config["COMPRESS_STREAMS"] = False
+Compress(app)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 
 # Load environment variables
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 DB_URL = os.getenv("DATABASE_URL")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", 2000))
 
 if not OPENAI_KEY:
     logging.error("❌ Missing OPENAI_API_KEY — please set it in Railway environment variables.")
 if not DB_URL:
     logging.warning("⚠️ No DATABASE_URL found — DB features disabled.")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_KEY)
+# Initialize OpenAI client on a shared, keep-alive HTTP connection pool.
+# HTTP/2 multiplexes concurrent completions over one TLS connection; failed connects are retried.
+http_client = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=os.getenv("OPENAI_HTTP2", "1") == "1",
+        retries=2,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+            keepalive_expiry=60.0,
+        ),
+    ),
+    # Bounded so a stalled completion can't pin a worker thread indefinitely
+    timeout=httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", 30)), connect=5.0),
+)
+# Transient 429/5xx/connection errors are retried with exponential backoff by the SDK
+client = OpenAI(api_key=OPENAI_KEY, http_client=http_client, max_retries=3)
+# A non-streamed completion only replies once every token is written, so its read timeout
+# scales with OPENAI_MAX_TOKENS (~25 tokens/s worst case). One retry at most: each timed-out
+# attempt is a billed generation made while holding an openai_slots permit.
+OPENAI_COMPLETION_TIMEOUT = float(os.getenv("OPENAI_COMPLETION_TIMEOUT", max(60, OPENAI_MAX_TOKENS / 25)))
+completion_client = client.with_options(
+    timeout=httpx.Timeout(OPENAI_COMPLETION_TIMEOUT, connect=5.0), max_retries=1
+)
+
+def warm_openai_connection():
+    """Opens the OpenAI connection ahead of the first lesson request."""
+    try:
+        client.models.list()
+    except Exception as e:
+        logging.warning("⚠️ OpenAI warm-up failed: %s", e)
+# Cap in-flight OpenAI calls per worker so bursts queue instead of tripping rate limits
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", 10))
+openai_slots = threading.BoundedSemaphore(OPENAI_CONCURRENCY)
+
+# Lesson source text sent to the model is capped at this many characters
+MAX_CONTENT_CHARS = 5000
+
+# Largest page /fetch_data will return in one response
+FETCH_PAGE_SIZE = int(os.getenv("FETCH_PAGE_SIZE", 1000))
+
+PG_MAX = int(os.getenv("PG_MAX", 25))
+
+def create_pool():
+    """Open the optional DB connection pool (None when no DATABASE_URL)."""
+    if not DB_URL:
+        return None
+    # Thread-safe pool sized for gthread workers; runaway queries are cut off server-side
+    return ThreadedConnectionPool(
+        minconn=int(os.getenv("PG_MIN", 5)),
+        maxconn=PG_MAX,
+        dsn=DB_URL,
+        options=f"-c statement_timeout={int(os.getenv('PG_STATEMENT_TIMEOUT_MS', 10000))}",
+    )
 
 # Optional DB connection pool
-pool = SimpleConnectionPool(1, 10, dsn=DB_URL) if DB_URL else None
+pool = create_pool()
+# getconn() raises PoolError the moment all PG_MAX connections are out, so borrowers
+# (request threads or greenlets plus executor threads) queue here for a free one instead
+pool_slots = threading.BoundedSemaphore(PG_MAX)
+PG_POOL_WAIT_SECONDS = float(os.getenv("PG_POOL_WAIT", 30))
 
 # ------------------------------------------------------------
 # HELPERS
@@ -42,23 +141,215 @@ def get_conn():
     """Get connection from pool (if available)."""
     if not pool:
         raise Exception("Database not configured.")
-    return pool.getconn()
+    conn = pool.getconn()
+    if conn.closed:  # dropped by the server while idle; swap in a fresh one
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
 
 def put_conn(c):
     """Return connection to pool."""
     if pool and c:
-        pool.putconn(c)
+        pool.putconn(c, close=bool(c.closed))
 
-def extract_text_from_pdf(file):
-    """Extracts up to 5000 characters of text from uploaded PDF."""
+@contextmanager
+def db():
+    """Borrow a pooled connection: commit on success, roll back on error, always return it."""
+    if not pool_slots.acquire(timeout=PG_POOL_WAIT_SECONDS):
+        raise Exception("Database busy: no free connection.")
     try:
-        reader = PdfReader(file)
-        text = "\n".join([p.extract_text() or "" for p in reader.pages])
-        return text[:5000] if text.strip() else "PDF content extracted (empty)."
+        conn = get_conn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            put_conn(conn)
+    finally:
+        pool_slots.release()
+
+# Generated lessons are kept this long; keys change with the prompt, so old entries only age out
+LESSON_CACHE_TTL_DAYS = int(os.getenv("LESSON_CACHE_TTL_DAYS", 30))
+PURGE_INTERVAL_SECONDS = 3600
+last_purge = time.monotonic()  # init_db purges at startup
+last_purge_lock = threading.Lock()
+
+def purge_expired_rows(cur):
+    """Deletes finished jobs, stale batch records and expired cache entries."""
+    cur.execute("DELETE FROM lesson_jobs WHERE created_at < NOW() - INTERVAL '1 day'")
+    # Batches may take their full 24h window, so keep rows a day past that for polling
+    cur.execute("DELETE FROM lesson_batches WHERE created_at < NOW() - INTERVAL '2 days'")
+    cur.execute(
+        "DELETE FROM lesson_cache WHERE created_at < NOW() - make_interval(days => %s)",
+        (LESSON_CACHE_TTL_DAYS,),
+    )
+
+def schedule_purge():
+    """Queues purge_expired_rows at most once per PURGE_INTERVAL_SECONDS per worker; called after writes."""
+    global last_purge
+    with last_purge_lock:
+        if time.monotonic() - last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        last_purge = time.monotonic()
+    job_executor.submit(run_purge)
+
+def run_purge():
+    """Runs purge_expired_rows in its own transaction, logging instead of raising."""
+    try:
+        with db() as conn, conn.cursor() as cur:
+            purge_expired_rows(cur)
     except Exception as e:
-        logging.error(f"PDF extraction failed: {e}")
+        logging.warning("⚠️ Purging expired rows failed: %s", e)
+
+# Arbitrary key for the advisory lock that lets one worker at a time migrate performance_data
+PERFORMANCE_MIGRATION_LOCK = 7_412_001
+
+PERFORMANCE_INDEXES = {
+    "performance_data_ts_idx": "CREATE INDEX performance_data_ts_idx ON performance_data (timestamp, id)",
+    "performance_data_learner_ts_idx": (
+        "CREATE INDEX performance_data_learner_ts_idx ON performance_data (learner_id, timestamp, id)"
+    ),
+}
+
+def init_db():
+    """Create tables once at startup so request handlers never run DDL."""
+    if not pool:
+        return
+    try:
+        with db() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS performance_data (
+                    id BIGSERIAL PRIMARY KEY,
+                    lesson_id TEXT,
+                    learner_id TEXT,
+                    understanding REAL,
+                    application REAL,
+                    communication REAL,
+                    behavior REAL,
+                    total REAL,
+                    timestamp TIMESTAMP DEFAULT NOW()
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lesson_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    html TEXT,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lesson_batches (
+                    batch_id TEXT PRIMARY KEY,
+                    lessons TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lesson_cache (
+                    content_hash TEXT PRIMARY KEY,
+                    fragments TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+                """
+            )
+            purge_expired_rows(cur)
+    except Exception as e:
+        logging.error("❌ Database initialization failed: %s", e)
+
+    # Separate transaction: a slow rewrite of an old table must not roll back the tables above
+    try:
+        migrate_performance_data()
+    except Exception as e:
+        logging.error("❌ performance_data migration failed: %s", e)
+
+def migrate_performance_data():
+    """Brings tables created by older versions up to date; issues DDL only for what is missing."""
+    with db() as conn, conn.cursor() as cur:
+        # Adding an id rewrites the table, which can outlast the per-request statement timeout
+        cur.execute("SET LOCAL statement_timeout = 0")
+        # Workers starting together queue here; later ones find nothing left to do
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PERFORMANCE_MIGRATION_LOCK,))
+        cur.execute(
+            "SELECT column_name, column_default FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'performance_data'"
+        )
+        columns = dict(cur.fetchall())
+        cur.execute(
+            "SELECT indexname FROM pg_indexes "
+            "WHERE schemaname = current_schema() AND tablename = 'performance_data'"
+        )
+        indexes = {r[0] for r in cur.fetchall()}
+
+        # Tables created before ids were introduced need one for keyset pagination
+        if "id" not in columns:
+            cur.execute("ALTER TABLE performance_data ADD COLUMN id BIGSERIAL")
+        if not (columns.get("timestamp") or "").lower().startswith("now()"):
+            cur.execute("ALTER TABLE performance_data ALTER COLUMN timestamp SET DEFAULT NOW()")
+        for name, ddl in PERFORMANCE_INDEXES.items():
+            if name not in indexes:
+                cur.execute(ddl)
+
+def extract_text_from_pdf(file, max_chars=MAX_CONTENT_CHARS):
+    """Extracts up to max_chars characters of text from uploaded PDF."""
+    try:
+        parts, total = [], 0
+        with fitz.open(stream=file.read(), filetype="pdf") as doc:
+            for page in doc:
+                t = page.get_text("text")
+                parts.append(t)
+                total += len(t) + 1
+                if total >= max_chars:
+                    break  # remaining pages would be truncated anyway
+        text = "\n".join(parts)[:max_chars]
+        return text if text.strip() else "PDF content extracted (empty)."
+    except Exception as e:
+        logging.error("PDF extraction failed: %s", e)
         return "PDF uploaded (text extraction failed)."
 
+# Fields the lesson form marks as required
+REQUIRED_LESSON_FIELDS = ("teacher", "lesson_title")
+
+def lesson_form_error():
+    """Returns a 400 response if required lesson fields are missing, else None."""
+    # The multipart upload is already parsed and spooled by now; this only skips PDF parsing and OpenAI
+    missing = [k for k in REQUIRED_LESSON_FIELDS if not request.form.get(k, "").strip()]
+    if missing:
+        return jsonify({"status": "error", "message": f"Missing field(s): {', '.join(missing)}"}), 400
+    return None
+
+def read_lesson_request():
+    """Reads lesson fields and uploaded content from the current form request."""
+    f = request.form
+    file = request.files.get("file")
+
+    content = ""
+    if file:
+        if file.filename.lower().endswith(".pdf"):
+            content = extract_text_from_pdf(file)
+        else:
+            # Read only as many bytes as the character cap can use (UTF-8 is at most 4 bytes/char)
+            raw = file.stream.read(MAX_CONTENT_CHARS * 4)
+            content = raw.decode("utf-8", errors="ignore")[:MAX_CONTENT_CHARS]
+
+    return (
+        f.get("teacher", ""),
+        f.get("lesson_title", ""),
+        f.get("duration", ""),
+        f.get("cefr", ""),
+        f.get("profile", ""),
+        content,
+    )
+
 def safe_float(v):
     """Convert to float safely (returns 0.0 if blank or invalid)."""
     try:
@@ -68,30 +359,23 @@ def safe_float(v):
     except Exception:
         return 0.0
 
+init_db()
+
 # ------------------------------------------------------------
 # LESSON PLAN GENERATOR
 # ------------------------------------------------------------
-def generate_lesson_plan_text(teacher, title, duration, cefr, profile, content):
-    """Generate structured HTML lesson plan including domain checklists."""
-    prompt = f"""
-You are a senior English Language Teaching (ELT) instructional designer for BAE Systems.
-
-Generate a professional, structured HTML lesson plan for classroom delivery using a formal instructional tone.
-
-Requirements:
-- Output valid HTML (no markdown, no code fences).
-- Include ALL sections as shown below.
-
-<h2>Lesson Plan</h2>
-<b>Title:</b> {title}<br>
-<b>Teacher:</b> {teacher}<br>
-<b>Duration:</b> {duration}<br>
-<b>CEFR Level:</b> {cefr}<br>
-<b>Learner Profile:</b> {profile}<br>
+# Static lesson-plan skeleton, filled server-side; the model only writes the
+# lesson-specific fragments, so none of this markup is sent or generated per call.
+_LESSON_TEMPLATE = string.Template("""<h2>Lesson Plan</h2>
+<b>Title:</b> $title<br>
+<b>Teacher:</b> $teacher<br>
+<b>Duration:</b> $duration<br>
+<b>CEFR Level:</b> $cefr<br>
+<b>Learner Profile:</b> $profile<br>
 
 <h3>1. Lesson Objectives</h3>
 <ul>
-<li>At least 3 measurable objectives aligned with CEFR outcomes.</li>
+$objectives
 </ul>
 
 <h3>2. Lesson Plan Structure</h3>
@@ -99,11 +383,7 @@ Requirements:
 <tr style="background:#e0e7ff;font-weight:bold;text-align:left">
 <th>Stage</th><th>Duration</th><th>Objective/Skill</th><th>Activities</th><th>Teacher Role</th><th>Learner Role</th><th>Materials</th>
 </tr>
-<tr><td>Warm-Up</td><td>5–10 min</td><td>Activate prior knowledge.</td><td>Quick discussion or brainstorming.</td><td>Facilitates, elicits responses.</td><td>Responds, shares ideas.</td><td>Board, visuals.</td></tr>
-<tr><td>Presentation</td><td>10 min</td><td>Introduce target language.</td><td>Demonstrate grammar or vocabulary use in context.</td><td>Explains, models, checks understanding.</td><td>Listens and takes notes.</td><td>Projector, whiteboard.</td></tr>
-<tr><td>Practice (Controlled)</td><td>10 min</td><td>Reinforce comprehension.</td><td>Pair or group structured exercises.</td><td>Monitors, corrects errors.</td><td>Completes tasks accurately.</td><td>Worksheets.</td></tr>
-<tr><td>Production (Freer)</td><td>10 min</td><td>Apply language creatively.</td><td>Role-play or group presentation.</td><td>Guides, observes, supports.</td><td>Uses target language independently.</td><td>Real-life prompts.</td></tr>
-<tr><td>Review & Wrap-Up</td><td>5 min</td><td>Summarize learning outcomes.</td><td>Class recap and reflection.</td><td>Summarizes key points.</td><td>Reflects, asks questions.</td><td>Notebook.</td></tr>
+$structure
 </table>
 
 <h3>3. Supporting Details</h3>
@@ -114,11 +394,7 @@ Requirements:
 <th>Method</th>
 <th>Expected Outcome</th>
 </tr>
-<tr><td>Warm-Up</td><td>...</td><td>...</td><td>...</td></tr>
-<tr><td>Presentation</td><td>...</td><td>...</td><td>...</td></tr>
-<tr><td>Practice (Controlled)</td><td>...</td><td>...</td><td>...</td></tr>
-<tr><td>Production (Freer)</td><td>...</td><td>...</td><td>...</td></tr>
-<tr><td>Review & Wrap-Up</td><td>...</td><td>...</td><td>...</td></tr>
+$supporting
 </table>
 
 <h3>4. Performance Domain Checklists</h3>
@@ -126,20 +402,25 @@ Requirements:
   <b>Each domain checklist</b> is rated <b>1–5</b> (5 = Excellent, 1 = Poor). Each domain totals <b>25 points</b>.
 </div>
 
-Lesson content reference:
-{content}
-
 <h4 style="color:#2563eb">Understanding (U)</h4>
-<ul><li>...</li><li>...</li></ul>
+<ul>
+$understanding
+</ul>
 
 <h4 style="color:#16a34a">Application (A)</h4>
-<ul><li>...</li><li>...</li></ul>
+<ul>
+$application
+</ul>
 
 <h4 style="color:#f59e0b">Communication (C)</h4>
-<ul><li>...</li><li>...</li></ul>
+<ul>
+$communication
+</ul>
 
 <h4 style="color:#dc2626">Behavior (B)</h4>
-<ul><li>...</li><li>...</li></ul>
+<ul>
+$behavior
+</ul>
 
 <h3>5. Score Interpretation Key</h3>
 <table cellspacing="0" cellpadding="6" style="border-collapse:collapse;width:50%">
@@ -151,38 +432,161 @@ Lesson content reference:
 </table>
 
 <h3>6. Reflection (Instructor Review)</h3>
-<ul><!-- The model will generate three context-specific reflection questions below --></ul>
-"""
+<ul>
+$reflection
+</ul>
+""")
+
+# Code fences the model occasionally wraps around its JSON reply
+_FENCE_RE = re.compile(r"^```(?:json)?|```$", re.MULTILINE)
+
+# Fragments the model returns, one JSON key per template slot
+LESSON_SECTIONS = (
+    "objectives", "structure", "supporting",
+    "understanding", "application", "communication", "behavior", "reflection",
+)
+
+LESSON_SYSTEM_PROMPT = (
+    "You are an expert ELT instructional designer working under BAE Systems standards. "
+    "Write a professional lesson plan for classroom delivery in a formal instructional tone, "
+    "derived strictly from the lesson details and content provided by the user.\n"
+    "Respond with a single JSON object. Every value is an HTML fragment (no markdown, no code fences) "
+    "and the keys are exactly:\n"
+    "- objectives: at least 3 <li> items, each a measurable objective aligned with CEFR outcomes.\n"
+    "- structure: 5 <tr> rows, one per stage in this order: Warm-Up, Presentation, Practice (Controlled), "
+    "Production (Freer), Review & Wrap-Up. Each row has 7 <td> cells: Stage, Duration, Objective/Skill, "
+    "Activities, Teacher Role, Learner Role, Materials. Stage durations fit the lesson duration.\n"
+    "- supporting: 5 <tr> rows for the same stages, each with 4 <td> cells: Stage, Purpose, Method, Expected Outcome.\n"
+    "- understanding, application, communication, behavior: exactly 5 <li> items each, "
+    "measurable lesson-specific indicators for that performance domain, each rated 1–5.\n"
+    "- reflection: 3 <li> items, context-specific reflection questions for the instructor."
+)
+
+def lesson_request_body(title, duration, cefr, profile, content):
+    """Build the chat-completions request body for one lesson plan."""
+    details = {"title": title, "duration": duration, "cefr": cefr, "profile": profile, "content": content}
+    return {
+        "model": OPENAI_MODEL,
+        "temperature": 0.4,
+        "top_p": 0.9,
+        "max_tokens": OPENAI_MAX_TOKENS,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": LESSON_SYSTEM_PROMPT},
+            {"role": "user", "content": orjson.dumps(details).decode()},
+        ],
+    }
+
+def parse_lesson_fragments(raw):
+    """Parse the model's JSON reply into a dict of HTML fragments."""
+    raw = raw.strip()
+    if "```" in raw:
+        raw = _FENCE_RE.sub("", raw).strip()
+    data = orjson.loads(raw)
+    fragments = {}
+    for key in LESSON_SECTIONS:
+        value = data.get(key, "")
+        fragments[key] = "\n".join(map(str, value)) if isinstance(value, list) else str(value)
+    return fragments
+
+def render_lesson_html(teacher, title, duration, cefr, profile, fragments):
+    """Fill the static lesson skeleton with form fields and model fragments."""
+    return _LESSON_TEMPLATE.substitute(
+        teacher=escape(teacher),
+        title=escape(title),
+        duration=escape(duration),
+        cefr=escape(cefr),
+        profile=escape(profile),
+        **fragments,
+    )
+
+# Per-worker LRU in front of the Postgres lesson cache
+LESSON_CACHE_SIZE = int(os.getenv("LESSON_CACHE_SIZE", 512))
+lesson_memory_cache = OrderedDict()
+lesson_memory_lock = threading.Lock()
+
+# Model, sampling settings and system prompt are hashed into every key, so changing them invalidates old entries
+_LESSON_KEY_BASE = hashlib.blake2b(orjson.dumps(lesson_request_body("", "", "", "", "")), digest_size=16)
+
+def lesson_cache_key(title, duration, cefr, profile, content):
+    """Stable hash of everything the model sees for a lesson (BLAKE2b, non-crypto use).
+
+    Returns None when there is no lesson content, so title-only requests are never cached.
+    """
+    if not content.strip():
+        return None
+    # Case and spacing in the short form fields don't change the plan. In the source text
+    # case matters (names, acronyms, capitalisation exercises), so only whitespace is collapsed.
+    fields = [" ".join(f.lower().split()) for f in (title, cefr, profile, duration)]
+    fields.append(" ".join(content.split()))
+    h = _LESSON_KEY_BASE.copy()
+    h.update(orjson.dumps(fields))  # a JSON array keeps field boundaries unambiguous
+    return h.hexdigest()
+
+def remember_fragments(key, fragments):
+    """Put fragments in the in-process LRU, evicting the oldest entry when full."""
+    with lesson_memory_lock:
+        lesson_memory_cache[key] = fragments
+        lesson_memory_cache.move_to_end(key)
+        if len(lesson_memory_cache) > LESSON_CACHE_SIZE:
+            lesson_memory_cache.popitem(last=False)
+
+def load_cached_fragments(key):
+    """Return previously generated fragments for this key, or None."""
+    if key is None:
+        return None
+    with lesson_memory_lock:
+        if key in lesson_memory_cache:
+            lesson_memory_cache.move_to_end(key)
+            return lesson_memory_cache[key]
+    if not pool:
+        return None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.4,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert ELT instructional designer working under BAE Systems standards. "
-                        "Do not restate instructions or placeholders. "
-                        "Only output fully populated HTML sections that match the requested structure."
-                        "In the Performance Domain Checklists section, generate 5 measurable, lesson-specific indicators "
-                        "for each domain (Understanding, Application, Communication, Behavior), "
-                        "based strictly on the uploaded lesson content."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": f"Generate the following HTML structure exactly, filling all fields with relevant content derived from the uploaded lesson:\n\n{prompt}"
-                },
-            ],
-        )
+        with db() as conn, conn.cursor() as cur:
+            cur.execute("SELECT fragments FROM lesson_cache WHERE content_hash = %s", (key,))
+            row = cur.fetchone()
+    except Exception as e:
+        logging.warning("⚠️ Lesson cache lookup failed: %s", e)
+        return None
+    if not row:
+        return None
+    fragments = orjson.loads(row[0])
+    remember_fragments(key, fragments)
+    return fragments
 
-        html = response.choices[0].message.content.strip()
-        html = re.sub(r"^```(?:html)?|```$", "", html, flags=re.MULTILINE).strip()
-        html = html.replace("\\n", "\n").replace('\\"', '"')
-        return html
+def store_cached_fragments(key, fragments):
+    """Remember generated fragments so identical requests skip OpenAI."""
+    if key is None:
+        return
+    remember_fragments(key, fragments)
+    if not pool:
+        return
+    try:
+        with db() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO lesson_cache (content_hash, fragments) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (key, orjson.dumps(fragments).decode()),
+            )
+        schedule_purge()
+    except Exception as e:
+        logging.warning("⚠️ Lesson cache write failed: %s", e)
+
+def generate_lesson_plan_text(teacher, title, duration, cefr, profile, content):
+    """Generate structured HTML lesson plan including domain checklists."""
+    try:
+        key = lesson_cache_key(title, duration, cefr, profile, content)
+        fragments = load_cached_fragments(key)
+        if fragments is None:
+            with openai_slots:
+                response = completion_client.chat.completions.create(
+                    **lesson_request_body(title, duration, cefr, profile, content)
+                )
+            fragments = parse_lesson_fragments(response.choices[0].message.content)
+            store_cached_fragments(key, fragments)
+        return render_lesson_html(teacher, title, duration, cefr, profile, fragments)
 
     except Exception as e:
-        logging.error(f"AI generation failed: {e}")
+        logging.error("AI generation failed: %s", e)
         return f"<p style='color:red'>AI generation failed: {e}</p>"
 
 # ------------------------------------------------------------
@@ -199,84 +603,17 @@ def download_lesson_docx():
         if not html_content:
             return jsonify({"status": "error", "message": "No HTML received."}), 400
 
-        # ✅ Create a Word doc and set landscape layout
-        doc = Document()
-        section = doc.sections[0]
-        section.orientation = WD_ORIENT.LANDSCAPE
-        section.page_width, section.page_height = section.page_height, section.page_width
-
-        # ✅ Convert basic HTML formatting
-        html_content = html_content.replace("<br>", "\n").replace("</p>", "\n\n")
-
-        # Split by major blocks (headings, tables, lists, etc.)
-        html_blocks = re.split(r'(<h\d[^>]*>.*?</h\d>|<table.*?</table>|<ul>.*?</ul>)', html_content, flags=re.S | re.I)
-
-        for block in html_blocks:
-            if not block.strip():
-                continue
-
-            # ===== HEADINGS =====
-            if re.match(r"<h2", block, re.I):
-                doc.add_heading(re.sub(r"<.*?>", "", block), level=1)
-            elif re.match(r"<h3", block, re.I):
-                h = doc.add_heading(re.sub(r"<.*?>", "", block), level=2)
-                for r in h.runs:
-                    r.bold = True
-            elif re.match(r"<h4", block, re.I):
-                h = doc.add_heading(re.sub(r"<.*?>", "", block), level=3)
-                for r in h.runs:
-                    r.bold = True
-
-            # ===== TABLES =====
-            elif "<table" in block.lower():
-                rows = re.findall(r"<tr.*?>(.*?)</tr>", block, flags=re.S)
-                if rows:
-                    first_row = re.findall(r"<t[hd].*?>(.*?)</t[hd]>", rows[0], flags=re.S)
-                    table = doc.add_table(rows=1, cols=len(first_row))
-                    hdr_cells = table.rows[0].cells
-                    for i, cell in enumerate(first_row):
-                        text = re.sub(r"<.*?>", "", cell).strip()
-                        hdr_cells[i].text = text
-                        for p in hdr_cells[i].paragraphs:
-                            for r in p.runs:
-                                r.bold = True
-                    for row in rows[1:]:
-                        cols = re.findall(r"<t[hd].*?>(.*?)</t[hd]>", row, flags=re.S)
-                        if not cols:
-                            continue
-                        cells = table.add_row().cells
-                        for i, cell in enumerate(cols):
-                            text = re.sub(r"<.*?>", "", cell).strip()
-                            cells[i].text = text
-
-            # ===== BULLET LISTS =====
-            elif "<ul" in block.lower():
-                items = re.findall(r"<li.*?>(.*?)</li>", block, flags=re.S)
-                for li in items:
-                    doc.add_paragraph(re.sub(r"<.*?>", "", li), style="List Bullet")
-
-            # ===== PARAGRAPHS =====
-            else:
-                text = re.sub(r"<.*?>", "", block).strip()
-                if text:
-                    p = doc.add_paragraph(text)
-                    for r in p.runs:
-                        r.font.name = "Arial"
-
-        # ✅ Save final document
-        output = BytesIO()
-        doc.save(output)
-        output.seek(0)
+        data = build_docx(html_content)
 
         return send_file(
-            output,
+            BytesIO(data),
             mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             as_attachment=True,
             download_name="lesson_plan.docx"
         )
 
     except Exception as e:
-        logging.error(f"❌ DOCX generation failed: {e}")
+        logging.error("❌ DOCX generation failed: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # ------------------------------------------------------------
@@ -291,27 +628,373 @@ def home():
 def generate_lesson():
     """Handles lesson plan generation requests from the frontend."""
     try:
-        f = request.form
-        teacher = f.get("teacher", "")
-        title = f.get("lesson_title", "")
-        duration = f.get("duration", "")
-        cefr = f.get("cefr", "")
-        profile = f.get("profile", "")
-        file = request.files.get("file")
-
-        content = ""
-        if file:
-            if file.filename.lower().endswith(".pdf"):
-                content = extract_text_from_pdf(file)
-            else:
-                content = file.read().decode("utf-8", errors="ignore")
-
-        html_output = generate_lesson_plan_text(teacher, title, duration, cefr, profile, content)
+        if error := lesson_form_error():
+            return error
+        html_output = generate_lesson_plan_text(*read_lesson_request())
         return jsonify({"status": "success", "html": html_output})
 
     except Exception as e:
-        logging.error(f"❌ Error in /generate_lesson: {e}")
+        logging.error("❌ Error in /generate_lesson: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# ------------------------------------------------------------
+# BACKGROUND LESSON JOBS (submit + poll)
+# ------------------------------------------------------------
+job_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LESSON_JOB_WORKERS", 4)))
+# A job still without a result after this long died with its worker (crash or max_requests recycle)
+LESSON_JOB_TIMEOUT_SECONDS = int(os.getenv("LESSON_JOB_TIMEOUT", 600))
+
+def run_lesson_job(job_id, args):
+    """Generates a lesson plan off the request thread and stores the result."""
+    try:
+        html = generate_lesson_plan_text(*args)
+    except Exception as e:
+        logging.error("❌ Lesson job %s failed: %s", job_id, e)
+        html = f"<p style='color:red'>AI generation failed: {e}</p>"
+
+    # Stored in Postgres so whichever worker receives the poll can answer it
+    try:
+        with db() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE lesson_jobs SET html = %s WHERE job_id = %s", (html, job_id))
+    except Exception as e:
+        logging.error("❌ Saving lesson job %s failed: %s", job_id, e)
+
+
+@app.post("/submit_lesson")
+def submit_lesson():
+    """Queues lesson plan generation and returns a job id to poll."""
+    try:
+        if not pool:
+            return jsonify({"status": "error", "message": "Background jobs need a database."}), 503
+        if error := lesson_form_error():
+            return error
+        args = read_lesson_request()
+        job_id = uuid.uuid4().hex
+
+        with db() as conn, conn.cursor() as cur:
+            cur.execute("INSERT INTO lesson_jobs (job_id) VALUES (%s)", (job_id,))
+        schedule_purge()
+
+        job_executor.submit(run_lesson_job, job_id, args)
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+
+    except Exception as e:
+        logging.error("❌ Error in /submit_lesson: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.get("/lesson_result/<job_id>")
+def lesson_result(job_id):
+    """Returns 202 while a queued lesson is pending, 200 with its HTML, or 504 once it has timed out."""
+    try:
+        if not pool:
+            return jsonify({"status": "error", "message": "Background jobs need a database."}), 503
+        with db() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT html, created_at < NOW() - make_interval(secs => %s)
+                FROM lesson_jobs
+                WHERE job_id = %s AND created_at > NOW() - INTERVAL '1 day'
+                """,
+                (LESSON_JOB_TIMEOUT_SECONDS, job_id),
+            )
+            row = cur.fetchone()
+        if not row:
+            return jsonify({"status": "error", "message": "Unknown job id."}), 404
+
+        html, expired = row
+        if html is not None:
+            return jsonify({"status": "success", "html": html}), 200
+        if expired:
+            return jsonify({"status": "error", "message": "Lesson job did not finish; please resubmit."}), 504
+        return jsonify({"status": "pending"}), 202
+
+    except Exception as e:
+        logging.error("❌ Error in /lesson_result: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
+
+# ------------------------------------------------------------
+# STREAMING LESSON GENERATION (server-sent events)
+# ------------------------------------------------------------
+def sse(data, event=None):
+    """Format one server-sent event; data is JSON-encoded so newlines are safe."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {orjson.dumps(data).decode()}\n\n"
+
+
+def read_openai_stream(body, updates):
+    """Streams a completion into updates as ("delta", text), then ("done", full reply) or ("error", exc)."""
+    try:
+        parts = []
+        with openai_slots:
+            for chunk in client.chat.completions.create(**body, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    updates.put(("delta", delta))
+        updates.put(("done", "".join(parts)))
+    except Exception as e:
+        updates.put(("error", e))
+
+
+@app.post("/generate_lesson_stream")
+def generate_lesson_stream():
+    """Streams model tokens as they arrive, then a final 'done' event with the HTML."""
+    if error := lesson_form_error():
+        return error
+    teacher, title, duration, cefr, profile, content = read_lesson_request()
+    key = lesson_cache_key(title, duration, cefr, profile, content)
+
+    def events():
+        try:
+            fragments = load_cached_fragments(key)
+            if fragments is None:
+                # The upstream read runs on its own thread, so a slow client never holds an OpenAI slot
+                updates = queue.Queue()
+                body = lesson_request_body(title, duration, cefr, profile, content)
+                threading.Thread(target=read_openai_stream, args=(body, updates), daemon=True).start()
+                while True:
+                    kind, value = updates.get()
+                    if kind == "error":
+                        raise value
+                    if kind == "done":
+                        break
+                    yield sse(value)
+                fragments = parse_lesson_fragments(value)
+                # Don't hold the response open on the cache write
+                job_executor.submit(store_cached_fragments, key, fragments)
+
+            html = render_lesson_html(teacher, title, duration, cefr, profile, fragments)
+            yield sse(html, event="done")
+
+        except Exception as e:
+            logging.error("❌ Error in /generate_lesson_stream: %s", e)
+            yield sse(str(e), event="error")
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ------------------------------------------------------------
+# MULTI-LESSON GENERATION (parallel fan-out)
+# ------------------------------------------------------------
+MAX_BATCH_LESSONS = 50
+lesson_executor = ThreadPoolExecutor(max_workers=OPENAI_CONCURRENCY)
+
+# Keys read from each entry of a JSON lesson list, in generate_lesson_plan_text argument order
+LESSON_LIST_FIELDS = ("teacher", "lesson_title", "duration", "cefr", "profile", "content")
+
+def read_lesson_list(max_lessons):
+    """Parses a JSON {"lessons": [...]} body; returns (error_response, None) or (None, argument tuples)."""
+    def bad_request(message):
+        return (jsonify({"status": "error", "message": message}), 400), None
+
+    try:
+        payload = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return bad_request("Request body must be JSON.")
+    lessons = payload.get("lessons") if isinstance(payload, dict) else payload
+    if not lessons:
+        return bad_request("No lessons received.")
+    if not isinstance(lessons, list) or not all(isinstance(l, dict) for l in lessons):
+        return bad_request('Expected {"lessons": [...]} with one object per lesson.')
+    if len(lessons) > max_lessons:
+        return bad_request(f"At most {max_lessons} lessons per batch.")
+
+    args, invalid, missing = [], [], []
+    for i, lesson in enumerate(lessons):
+        values = [lesson.get(k) for k in LESSON_LIST_FIELDS]
+        if not all(v is None or isinstance(v, (str, int, float)) for v in values):
+            invalid.append(str(i))
+            continue
+        values = ["" if v is None else str(v) for v in values]
+        values[-1] = values[-1][:MAX_CONTENT_CHARS]
+        if not values[0].strip() or not values[1].strip():
+            missing.append(str(i))
+        args.append(tuple(values))
+    if invalid:
+        return bad_request(f"Lesson(s) {', '.join(invalid)} have non-text field values.")
+    if missing:
+        return bad_request(f"Lesson(s) {', '.join(missing)} missing {' or '.join(REQUIRED_LESSON_FIELDS)}.")
+    return None, args
+
+@app.post("/generate_lessons_batch")
+def generate_lessons_batch():
+    """Generates several lesson plans concurrently from a JSON list of lesson forms."""
+    try:
+        error, args = read_lesson_list(MAX_BATCH_LESSONS)
+        if error:
+            return error
+
+        # Calls share the keep-alive pool; openai_slots keeps them under the rate limit
+        results = list(lesson_executor.map(lambda a: generate_lesson_plan_text(*a), args))
+        return jsonify({"status": "success", "results": [{"html": h} for h in results]}), 200
+
+    except Exception as e:
+        logging.error("❌ Error in /generate_lessons_batch: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# ------------------------------------------------------------
+# OPENAI BATCH API (non-interactive generation)
+# ------------------------------------------------------------
+MAX_BULK_LESSONS = 1000
+
+def submit_openai_batch(bodies):
+    """Uploads chat-completion bodies as a JSONL batch (custom_id = list index); returns the batch."""
+    lines = b"".join(
+        orjson.dumps({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions", "body": body}) + b"\n"
+        for i, body in enumerate(bodies)
+    )
+    batch_file = client.files.create(file=("lessons.jsonl", lines), purpose="batch")
+    return client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+def queue_lesson_batch(args):
+    """Submits lessons as one batch and records their inputs, so only batches from this app can be polled."""
+    batch = submit_openai_batch([lesson_request_body(*a[1:]) for a in args])
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO lesson_batches (batch_id, lessons) VALUES (%s, %s)",
+            (batch.id, orjson.dumps(args).decode()),
+        )
+    schedule_purge()
+    return batch.id
+
+def read_batch_replies(batch_id):
+    """Returns (error_response, None) until a batch completes, then (None, {custom_id: reply})."""
+    batch = client.batches.retrieve(batch_id)
+    if batch.status in ("failed", "expired", "cancelled"):
+        return (jsonify({"status": "error", "message": f"Batch {batch.status}."}), 502), None
+    if batch.status != "completed":
+        return (jsonify({"status": batch.status}), 202), None
+    if not batch.output_file_id and not batch.error_file_id:
+        return (jsonify({"status": "error", "message": "Batch produced no output."}), 502), None
+
+    # Failed requests (output lines with an error status, or lines in the error file) map to None
+    replies = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                result = orjson.loads(line)
+                custom_id = result["custom_id"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                logging.warning("⚠️ Batch %s: unreadable result line skipped.", batch_id)
+                continue
+            reply = batch_line_reply(result)
+            if reply is None:
+                logging.warning("⚠️ Batch %s request %s failed: %s", batch_id, custom_id, result.get("error"))
+            replies.setdefault(custom_id, reply)
+    return None, replies
+
+def batch_line_reply(result):
+    """Returns the model's text from one batch result line, or None if that request failed."""
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+def batch_lesson_fragments(reply):
+    """Parses one batch reply into fragments, or None when it is missing or unusable (e.g. cut off at max_tokens)."""
+    if reply is None:
+        return None
+    try:
+        return parse_lesson_fragments(reply)
+    except Exception as e:
+        logging.warning("⚠️ Unusable batch reply: %s", e)
+        return None
+
+@app.post("/generate_lesson_async")
+def generate_lesson_async():
+    """Submits one lesson plan from the form as a Batch API job; poll it at /poll_lesson_batch."""
+    try:
+        if not pool:
+            return jsonify({"status": "error", "message": "Batch submissions need a database."}), 503
+        if error := lesson_form_error():
+            return error
+        batch_id = queue_lesson_batch([read_lesson_request()])
+        return jsonify({"status": "queued", "batch_id": batch_id}), 202
+
+    except Exception as e:
+        logging.error("❌ Error in /generate_lesson_async: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.post("/submit_lesson_batch")
+def submit_lesson_batch():
+    """Submits many lesson plans as one Batch API job and records it for polling."""
+    try:
+        if not pool:
+            return jsonify({"status": "error", "message": "Batch submissions need a database."}), 503
+        error, args = read_lesson_list(MAX_BULK_LESSONS)
+        if error:
+            return error
+
+        batch_id = queue_lesson_batch(args)
+        return jsonify({"status": "queued", "batch_id": batch_id, "count": len(args)}), 202
+
+    except Exception as e:
+        logging.error("❌ Error in /submit_lesson_batch: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.get("/poll_lesson_batch/<batch_id>")
+def poll_lesson_batch(batch_id):
+    """Returns 202 while a lesson batch runs, then every plan's HTML (cached for later requests)."""
+    try:
+        if not pool:
+            return jsonify({"status": "error", "message": "Batch submissions need a database."}), 503
+        with db() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT lessons FROM lesson_batches WHERE batch_id = %s AND created_at > NOW() - INTERVAL '2 days'",
+                (batch_id,),
+            )
+            row = cur.fetchone()
+        if not row:
+            return jsonify({"status": "error", "message": "Unknown batch id."}), 404
+
+        error, replies = read_batch_replies(batch_id)
+        if error:
+            return error
+
+        results, cache_rows = [], []
+        for i, (teacher, title, duration, cefr, profile, content) in enumerate(orjson.loads(row[0])):
+            fragments = batch_lesson_fragments(replies.get(str(i)))
+            if fragments is None:
+                results.append({"html": "<p style='color:red'>AI generation failed in batch.</p>"})
+                continue
+            results.append({"html": render_lesson_html(teacher, title, duration, cefr, profile, fragments)})
+            key = lesson_cache_key(title, duration, cefr, profile, content)
+            if key:
+                remember_fragments(key, fragments)
+                cache_rows.append((key, orjson.dumps(fragments).decode()))
+
+        # Seed the lesson cache in one statement so these plans are instant next time
+        if cache_rows:
+            with db() as conn, conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO lesson_cache (content_hash, fragments) VALUES %s ON CONFLICT DO NOTHING",
+                    cache_rows,
+                    page_size=500,
+                )
+        return jsonify({"status": "success", "results": results}), 200
+
+    except Exception as e:
+        logging.error("❌ Error in /poll_lesson_batch: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # ------------------------------------------------------------
 # SAVE PERFORMANCE DATA ENDPOINT
 # ------------------------------------------------------------
@@ -319,46 +1002,53 @@ def generate_lesson():
 def save_performance():
     """Handles saving performance data from the Performance Register."""
     try:
-        data = request.get_json(force=True)
+        data = orjson.loads(request.get_data())
         if not data:
             return jsonify({"status": "error", "message": "No data received"}), 400
 
         # ✅ Log the data received
-        logging.info("✅ Received performance data:")
-        for row in data:
-            logging.info(row)
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("✅ Received performance data:")
+            for row in data:
+                logging.info(row)
 
         # ✅ If no database configured, simulate success
         if not pool:
             return jsonify({"status": "success", "message": "Data received (no DB connected)."}), 200
 
         # ✅ Otherwise, save to database
-        conn = get_conn()
-        cur = conn.cursor()
-        for row in data:
-            cur.execute(
+        rows = [
+            (
+                row["lesson_id"],
+                row["learner_id"],
+                row["understanding"],
+                row["application"],
+                row["communication"],
+                row["behavior"],
+                row["total"],
+            )
+            for row in data
+        ]
+
+        with db() as conn, conn.cursor() as cur:
+            # One multi-row INSERT per 500 records instead of a round-trip per record.
+            # NOW() is explicit so rows are stamped even if the column default was never migrated.
+            execute_values(
+                cur,
                 """
                 INSERT INTO performance_data
                 (lesson_id, learner_id, understanding, application, communication, behavior, total, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                VALUES %s
                 """,
-                (
-                    row["lesson_id"],
-                    row["learner_id"],
-                    row["understanding"],
-                    row["application"],
-                    row["communication"],
-                    row["behavior"],
-                    row["total"],
-                ),
+                rows,
+                template="(%s, %s, %s, %s, %s, %s, %s, NOW())",
+                page_size=500,
             )
-        conn.commit()
-        put_conn(conn)
 
         return jsonify({"status": "success", "message": "Performance data saved successfully."}), 200
 
     except Exception as e:
-        logging.error(f"❌ Error saving performance data: {e}")
+        logging.error("❌ Error saving performance data: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # ------------------------------------------------------------
@@ -371,6 +1061,12 @@ def fetch_data():
         learner_id = request.args.get("learner_id")
         from_date = request.args.get("from")
         to_date = request.args.get("to")
+        cursor_ts = request.args.get("cursor_ts")
+        cursor_id = request.args.get("cursor_id")
+        try:
+            limit = min(max(int(request.args.get("limit", FETCH_PAGE_SIZE)), 1), FETCH_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid limit."}), 400
 
         # ✅ Return mock data if DB not connected
         if not pool:
@@ -397,11 +1093,8 @@ def fetch_data():
             return jsonify(sample), 200
 
         # ✅ Otherwise, pull from database
-        conn = get_conn()
-        cur = conn.cursor()
-
         query = """
-            SELECT learner_id, understanding, application, communication, behavior, total, timestamp
+            SELECT learner_id, understanding, application, communication, behavior, total, timestamp, id
             FROM performance_data
             WHERE 1=1
         """
@@ -416,29 +1109,48 @@ def fetch_data():
         if to_date:
             query += " AND timestamp <= %s"
             params.append(to_date)
+        # Keyset pagination: resume strictly after the last row of the previous page
+        if cursor_ts and cursor_id:
+            query += " AND (timestamp, id) < (%s, %s)"
+            params.extend([cursor_ts, cursor_id])
 
-        query += " ORDER BY timestamp DESC"
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        put_conn(conn)
-
-        results = [
-            {
-                "learner_id": r[0],
-                "understanding": r[1],
-                "application": r[2],
-                "communication": r[3],
-                "behavior": r[4],
-                "total": r[5],
-                "timestamp": r[6].strftime("%Y-%m-%d %H:%M"),
-            }
-            for r in rows
-        ]
+        query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+        params.append(limit)
+
+        # Postgres serializes the page itself (::text keeps psycopg2 from decoding it again),
+        # along with the row count and the last row's key for the next cursor
+        query = f"""
+            SELECT COALESCE(json_agg(json_build_object(
+                       'learner_id', learner_id,
+                       'understanding', understanding,
+                       'application', application,
+                       'communication', communication,
+                       'behavior', behavior,
+                       'total', total,
+                       'timestamp', to_char(timestamp, 'YYYY-MM-DD HH24:MI')
+                   ) ORDER BY timestamp DESC, id DESC), '[]')::text,
+                   count(*),
+                   (array_agg(timestamp ORDER BY timestamp, id))[1],
+                   (array_agg(id ORDER BY timestamp, id))[1]
+            FROM ({query}) page
+        """
+
+        with db() as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            body, count, last_ts, last_id = cur.fetchone()
 
-        return jsonify(results), 200
+        response = Response(body, mimetype="application/json")
+        # A full page means there may be more rows; hand back the cursor for the next one
+        if count == limit:
+            response.headers["X-Next-Cursor-Ts"] = last_ts.isoformat()
+            response.headers["X-Next-Cursor-Id"] = str(last_id)
+        # Unchanged pages revalidate with a 304 instead of re-sending the body
+        response.add_etag()
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
 
     except Exception as e:
-        logging.error(f"❌ Error fetching data: {e}")
+        logging.error("❌ Error fetching data: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+from io import BytesIO
+from lxml import html as lxml_html
+from docx import Document
+from docx.enum.section import WD_ORIENT
+
+# ------------------------------------------------------------
+# DOCX EXPORT
+# ------------------------------------------------------------
+# Pure HTML -> DOCX conversion with no Flask, database or OpenAI state, so it
+# can be imported and exercised without starting the app. One lxml parse, then
+# a single tree walk; lesson documents are tens of KB, so it runs on the request thread.
+DOCX_HEADING_LEVELS = {"h2": 1, "h3": 2, "h4": 3}
+
+def add_docx_table(doc, table_el):
+    """Copies an HTML <table> into the document, bolding the first row."""
+    rows = [[c.text_content().strip() for c in tr.xpath("./th|./td")] for tr in table_el.xpath(".//tr")]
+    rows = [r for r in rows if r]
+    if not rows:
+        return
+    table = doc.add_table(rows=1, cols=len(rows[0]))
+    for cell, text in zip(table.rows[0].cells, rows[0]):
+        cell.text = text
+        for p in cell.paragraphs:
+            for r in p.runs:
+                r.bold = True
+    for row in rows[1:]:
+        for cell, text in zip(table.add_row().cells, row):
+            cell.text = text
+
+def write_html_to_docx(doc, html_content):
+    """Adds headings, tables, bullet lists and paragraphs from lesson HTML to doc."""
+    inline = []
+    bullet = doc.styles["List Bullet"]  # looked up once, not per <li>
+
+    def flush():
+        text = "".join(inline).strip()
+        inline.clear()
+        if text:
+            p = doc.add_paragraph(text)
+            for r in p.runs:
+                r.font.name = "Arial"
+
+    def walk(el):
+        tag = el.tag if isinstance(el.tag, str) else ""  # comments have a callable tag
+        if tag in DOCX_HEADING_LEVELS:
+            flush()
+            h = doc.add_heading(el.text_content().strip(), level=DOCX_HEADING_LEVELS[tag])
+            if tag != "h2":
+                for r in h.runs:
+                    r.bold = True
+        elif tag == "table":
+            flush()
+            add_docx_table(doc, el)
+        elif tag in ("ul", "ol"):
+            flush()
+            for li in el.xpath("./li"):
+                doc.add_paragraph(li.text_content().strip(), style=bullet)
+        elif tag == "br":
+            inline.append("\n")
+        elif tag:
+            inline.append(el.text or "")
+            for child in el:
+                walk(child)
+            if tag == "p":
+                inline.append("\n\n")
+        inline.append(el.tail or "")
+
+    root = lxml_html.fragment_fromstring(html_content, create_parent="div")
+    inline.append(root.text or "")
+    for child in root:
+        walk(child)
+    flush()
+
+def landscape_template():
+    """Saves an empty landscape document once; each export starts from these bytes."""
+    doc = Document()
+    section = doc.sections[0]
+    section.orientation = WD_ORIENT.LANDSCAPE
+    section.page_width, section.page_height = section.page_height, section.page_width
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+DOCX_TEMPLATE = landscape_template()
+
+def build_docx(html_content):
+    """Renders lesson HTML as a landscape Word document and returns its bytes."""
+    doc = Document(BytesIO(DOCX_TEMPLATE))
+    write_html_to_docx(doc, html_content)
+
+    # ✅ Save final document
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
@@ -0,0 +1,51 @@
+import os
+import threading
+
+# ------------------------------------------------------------
+# GUNICORN SETTINGS
+# ------------------------------------------------------------
+# Every endpoint spends most of its time waiting on OpenAI or Postgres,
+# so each worker runs many threads instead of serving one request at a time.
+# Set GUNICORN_WORKER_CLASS=gevent to interleave requests on greenlets instead.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 200))
+timeout = 180
+max_requests = 1000
+max_requests_jitter = 200
+
+# Import the app once in the master so workers fork with it already loaded.
+# gevent must patch the stdlib before the app creates its locks, so it loads per worker.
+preload_app = worker_class != "gevent"
+
+
+def when_ready(server):
+    """Close the master's DB connections before any worker is forked."""
+    if not preload_app:
+        return  # the master never imported the app
+    import app
+
+    if app.pool:
+        app.pool.closeall()
+
+
+def post_fork(server, worker):
+    """Give each worker its own DB pool; psycopg2 connections must not cross a fork."""
+    if worker_class == "gevent":
+        # Make psycopg2 yield to other greenlets while waiting on Postgres
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+        return  # app is not preloaded; it creates its own pool on import
+
+    import app
+
+    app.pool = app.create_pool()
+
+
+def post_worker_init(worker):
+    """Warm the worker's OpenAI connection in the background so boot isn't delayed."""
+    import app
+
+    threading.Thread(target=app.warm_openai_connection, daemon=True).start()